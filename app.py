@@ -3,13 +3,25 @@
 
 import os
 import io
-import base64
+import collections
+import functools
+import hashlib
+import multiprocessing
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
+from html import escape
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
 from flask import Flask, request, send_file, render_template_string
-from weasyprint import HTML
+from jinja2 import Environment
+from markupsafe import Markup
+from weasyprint import HTML, CSS
+from weasyprint.text.fonts import FontConfiguration
 
 # -------------------------------------------------------------------
 # Configuração básica do Flask
@@ -19,64 +31,203 @@ app = Flask(__name__)
 # -------------------------------------------------------------------
 # Funções auxiliares
 # -------------------------------------------------------------------
-def classificar_janela(dt):
-    """Classifica a janela horária baseada no horário de saída."""
-    if pd.isna(dt):
-        return np.nan
-    h = dt.time()
-    if h < pd.to_datetime('09:00').time():
-        return 'J1'
-    if h < pd.to_datetime('10:30').time():
-        return 'J2'
-    if h < pd.to_datetime('12:00').time():
-        return 'J3'
-    if h < pd.to_datetime('14:30').time():
-        return 'J4'
-    return 'J5'
-
-
-def gerar_html_tabela(df, colunas):
-    """Gera HTML de uma tabela a partir de um DataFrame."""
+JANELAS = ['J1', 'J2', 'J3', 'J4', 'J5']
+
+# Limites entre as janelas em minutos desde 00:00 (09:00, 10:30, 12:00, 14:30)
+LIMITES_JANELAS = np.array([540, 630, 720, 870])
+
+
+def minutos_do_dia(dthr):
+    """Converte uma série de horários em minutos desde 00:00 (NaN para NaT)."""
+    return dthr.dt.hour * 60 + dthr.dt.minute
+
+
+# 'HH:MM' de cada minuto do dia, indexado por minutos desde 00:00
+HORARIOS_DIA = np.array([f'{m // 60:02d}:{m % 60:02d}' for m in range(24 * 60)], dtype=object)
+
+
+def formatar_minutos(minutos):
+    """Formata minutos desde 00:00 como 'HH:MM'."""
+    return HORARIOS_DIA[minutos.to_numpy(dtype=np.int64)]
+
+
+def classificar_janelas(minutos):
+    """Classifica as janelas horárias (J1..J5) a partir dos minutos desde 00:00."""
+    valores = minutos.to_numpy(dtype=float, na_value=np.nan)
+    codigos = np.searchsorted(LIMITES_JANELAS, valores, side='right')
+    codigos[np.isnan(valores)] = -1
+    return pd.Series(pd.Categorical.from_codes(codigos, categories=JANELAS), index=minutos.index)
+
+
+# Códigos da coluna SITUACAO
+SIT_ENTREGUE = 0
+SIT_DEVOLVIDO = 1
+SIT_EM_ENTREGA = 2
+SIT_OUTRA = 3
+
+
+def classificar_situacao(situacao):
+    """
+    Classifica a coluna SITUACAO em códigos int8 (SIT_ENTREGUE, SIT_DEVOLVIDO,
+    SIT_EM_ENTREGA ou SIT_OUTRA). Cada valor distinto é avaliado uma única vez.
+    """
+    codigos, valores = pd.factorize(situacao)
+    # A última posição atende o código -1 (valores vazios)
+    tabela = np.full(len(valores) + 1, SIT_OUTRA, dtype=np.int8)
+    for i, valor in enumerate(valores):
+        texto = str(valor).lower()
+        if 'entregue' in texto:
+            tabela[i] = SIT_ENTREGUE
+        elif 'devolvido' in texto:
+            tabela[i] = SIT_DEVOLVIDO
+        elif 'em entrega' in texto:
+            tabela[i] = SIT_EM_ENTREGA
+    return pd.Series(tabela[codigos], index=situacao.index)
+
+
+def gerar_html_tabela(df, colunas, totais=None):
+    """
+    Gera HTML de uma tabela a partir de um DataFrame.
+    `colunas` são os rótulos do cabeçalho, na mesma ordem das colunas do df;
+    `totais` (opcional) são as células de uma linha final de totais. Os valores
+    das células são escapados (nomes de bairro/motorista podem ter & ou <).
+    """
     if df is None or df.empty:
         return "<p>Sem dados para exibir.</p>"
 
-    html = '<table>\n<thead>\n<tr>\n'
     # Cabeçalho
-    for col in colunas:
-        html += f'<th>{col}</th>\n'
-    html += '</tr>\n</thead>\n<tbody>\n'
+    cabecalho = ''.join(f'<th>{col}</th>\n' for col in colunas)
 
     # Linhas
-    for _, row in df.iterrows():
-        html += '<tr>'
-        for col in colunas:
-            html += f'<td>{row[col]}</td>'
-        html += '</tr>\n'
+    linhas = ''.join(
+        '<tr>' + ''.join(f'<td>{escape(str(valor))}</td>' for valor in row) + '</tr>\n'
+        for row in df.to_numpy(dtype=object)
+    )
+    if totais is not None:
+        linhas += '<tr>' + ''.join(f'<td>{escape(str(valor))}</td>' for valor in totais) + '</tr>\n'
+
+    return f'<table>\n<thead>\n<tr>\n{cabecalho}</tr>\n</thead>\n<tbody>\n{linhas}</tbody>\n</table>'
 
-    html += '</tbody>\n</table>'
-    return html
 
+BASE_DIR = Path(__file__).resolve().parent
 
-def img_to_data_uri(filename):
-    """Converte uma imagem local em data URI base64 para embutir no HTML."""
-    if not os.path.exists(filename):
-        return ""
-    with open(filename, "rb") as f:
-        data = f.read()
-    encoded = base64.b64encode(data).decode("ascii")
-    ext = os.path.splitext(filename)[1].lower().replace(".", "")
-    mime = f"image/{'png' if ext == 'png' else ext}"
-    return f"data:{mime};base64,{encoded}"
+
+def img_to_file_uri(filename):
+    """
+    Devolve a URL file:// de uma imagem da pasta do app (vazio se não existir).
+    O WeasyPrint carrega o arquivo direto e guarda a imagem decodificada no
+    CACHE_IMAGENS do processo, sem passar por base64 no HTML/CSS.
+    """
+    caminho = BASE_DIR / filename
+    return caminho.as_uri() if caminho.exists() else ""
+
+
+# Imagens do cabeçalho
+LOGO_URI = img_to_file_uri("Logo Oliveira Sem Fundo.png")
+MASCOTE_URI = img_to_file_uri("Oliver_RomaneioSF.png")
+
+
+# Colunas da planilha usadas pelos relatórios; as demais nem são lidas
+COLUNAS_PLANILHA = frozenset([
+    'DTHRSAIDA', 'EMISSAO', 'HORAGRAV', 'DTHRRET',
+    'SITUACAO', 'MOTORISTA', 'BAIRRO', 'TPRODADO', 'ESTABEX',
+])
+
+# Leitor do Excel: calamine (Rust) quando instalado; senão o padrão do pandas (openpyxl)
+try:
+    import python_calamine  # noqa: F401
+    MOTOR_EXCEL = "calamine"
+except ImportError:
+    MOTOR_EXCEL = None
+
+
+def ler_planilha(conteudo_planilha):
+    """Lê a planilha enviada (bytes do .xlsx) apenas com as colunas usadas nos relatórios."""
+    return pd.read_excel(
+        io.BytesIO(conteudo_planilha),
+        engine=MOTOR_EXCEL,
+        usecols=lambda col: col in COLUNAS_PLANILHA,
+    )
+
+
+def validar_colunas(df, obrigatorias):
+    """Confere de uma vez as colunas obrigatórias do relatório (ValueError se faltar alguma)."""
+    faltando = sorted(frozenset(obrigatorias) - frozenset(df.columns))
+    if len(faltando) == 1:
+        raise ValueError(f"A planilha não possui a coluna '{faltando[0]}'.")
+    if faltando:
+        nomes = ', '.join(f"'{col}'" for col in faltando)
+        raise ValueError(f"A planilha não possui as colunas {nomes}.")
+
+
+def mascara_dias(dthr, data_ini, data_fim):
+    """
+    Máscara das linhas com horário entre data_ini e data_fim (inclusive).
+    Compara os datetime64 direto com o intervalo [data_ini, data_fim + 1 dia),
+    sem converter a coluna; NaT fica de fora.
+    """
+    valores = dthr.to_numpy()
+    return (valores >= np.datetime64(data_ini, 'D')) & (valores < np.datetime64(data_fim, 'D') + 1)
+
+
+def selecionar_linhas(df, mask, colunas):
+    """
+    Seleciona as linhas de `mask` trazendo só as `colunas` (das que existirem no
+    df) usadas pelo relatório. O resultado já é uma cópia estreita: dá para
+    acrescentar colunas sem copiar a planilha inteira com .copy().
+    """
+    return df.loc[mask, df.columns.intersection(colunas)]
 
 
 def preparar_dataframe(df):
-    """Garante que as colunas de data estejam em datetime."""
-    for col in ['DTHRSAIDA', 'EMISSAO', 'HORAGRAV', 'DTHRRET']:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
+    """
+    Garante que as colunas de data estejam em datetime e converte as colunas
+    de texto com poucos valores distintos para `category` (groupby, contagens
+    e comparações passam a operar sobre os códigos inteiros). Também calcula
+    uma única vez o minuto do dia (MINUTO) e a janela (JANELA) de cada saída.
+    """
+    colunas = frozenset(df.columns)
+    for col in colunas & {'DTHRSAIDA', 'EMISSAO', 'HORAGRAV', 'DTHRRET'}:
+        if not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], errors='coerce', cache=True)
+    for col in colunas & {'MOTORISTA', 'BAIRRO', 'SITUACAO'}:
+        df[col] = df[col].astype('category')
+    if 'DTHRSAIDA' in colunas:
+        df['MINUTO'] = minutos_do_dia(df['DTHRSAIDA']).astype('Int16')
+        df['JANELA'] = classificar_janelas(df['MINUTO'])
     return df
 
 
+# Planilhas já lidas e tratadas neste processo, pelo hash do conteúdo
+# (a mais recente no fim). O mesmo arquivo costuma gerar mais de um relatório.
+# Cada worker do pool tem o seu cache, então ele fica pequeno: poucas entradas
+# e um teto de memória (planilhas maiores que o teto não são guardadas).
+CACHE_PLANILHAS = collections.OrderedDict()
+CACHE_PLANILHAS_MAX = 2
+CACHE_PLANILHAS_MAX_BYTES = 64 * 1024 * 1024
+
+
+def carregar_planilha(conteudo_planilha):
+    """
+    Lê e trata a planilha enviada, reaproveitando o DataFrame quando o mesmo
+    arquivo já foi lido neste processo.
+    """
+    chave = hashlib.blake2b(conteudo_planilha, digest_size=16).digest()
+    entrada = CACHE_PLANILHAS.get(chave)
+    if entrada is None:
+        df = preparar_dataframe(ler_planilha(conteudo_planilha))
+        tamanho = int(df.memory_usage(deep=True).sum())
+        if tamanho <= CACHE_PLANILHAS_MAX_BYTES:
+            CACHE_PLANILHAS[chave] = (df, tamanho)
+            while (len(CACHE_PLANILHAS) > CACHE_PLANILHAS_MAX
+                   or sum(t for _, t in CACHE_PLANILHAS.values()) > CACHE_PLANILHAS_MAX_BYTES):
+                CACHE_PLANILHAS.popitem(last=False)
+    else:
+        df = entrada[0]
+        CACHE_PLANILHAS.move_to_end(chave)
+    return df.copy(deep=False)
+
+
 # -------------------------------------------------------------------
 # Processamento DIÁRIO
 # -------------------------------------------------------------------
@@ -87,28 +238,27 @@ def processar_dados_diarios(df, data_referencia):
     """
     data_ref = pd.to_datetime(data_referencia).date()
 
-    if 'DTHRSAIDA' not in df.columns:
-        raise ValueError("A planilha não possui a coluna 'DTHRSAIDA'.")
+    validar_colunas(df, ['DTHRSAIDA', 'MOTORISTA', 'BAIRRO'])
 
-    mask = df['DTHRSAIDA'].dt.date == data_ref
-    base = df[mask].copy()
+    mask = mascara_dias(df['DTHRSAIDA'], data_ref, data_ref)
+    base = selecionar_linhas(df, mask, ['DTHRSAIDA', 'MINUTO', 'JANELA', 'SITUACAO', 'MOTORISTA', 'BAIRRO'])
 
     if base.empty:
         raise ValueError("Não há entregas para a data selecionada.")
 
     # Totais gerais
     if 'SITUACAO' in base.columns:
-        entregue = (base['SITUACAO'].str.contains('Entregue', case=False, na=False)).sum()
-        devolvido = (base['SITUACAO'].str.contains('Devolvido', case=False, na=False)).sum()
-        em_entrega = (base['SITUACAO'].str.contains('Em Entrega', case=False, na=False)).sum()
+        contagem = np.bincount(classificar_situacao(base['SITUACAO']), minlength=4)
+        entregue = contagem[SIT_ENTREGUE]
+        devolvido = contagem[SIT_DEVOLVIDO]
+        em_entrega = contagem[SIT_EM_ENTREGA]
     else:
         entregue = devolvido = em_entrega = 0
 
     TOTAL = len(base)
     TD_pct = round(100 * devolvido / (entregue + devolvido), 2) if (entregue + devolvido) > 0 else 0.0
 
-    # Classificar janelas
-    base['JANELA'] = base['DTHRSAIDA'].apply(classificar_janela)
+    # Janelas (já classificadas na preparação da planilha)
     janela_counts = base['JANELA'].value_counts().to_dict()
 
     J1 = janela_counts.get('J1', 0)
@@ -129,44 +279,35 @@ def processar_dados_diarios(df, data_referencia):
     GAP_J1 = meta['J1'] - J1
     GAP_J4 = meta['J4'] - J4
 
-    # Distribuição 1ª janela com horário
-    base_J1 = base[base['JANELA'] == 'J1'].copy()
-    if not base_J1.empty:
-        base_J1['HORA_SAIDA'] = base_J1['DTHRSAIDA'].dt.strftime('%H:%M')
-        J1_dist = (
-            base_J1.groupby(['HORA_SAIDA', 'MOTORISTA', 'BAIRRO'])
-            .size()
-            .reset_index(name='QTD')
-            .sort_values(['HORA_SAIDA', 'MOTORISTA', 'BAIRRO'])
-        )
-    else:
-        J1_dist = pd.DataFrame(columns=['HORA_SAIDA', 'MOTORISTA', 'BAIRRO', 'QTD'])
-
-    # Distribuição 4ª janela com horário
-    base_J4 = base[base['JANELA'] == 'J4'].copy()
-    if not base_J4.empty:
-        base_J4['HORA_SAIDA'] = base_J4['DTHRSAIDA'].dt.strftime('%H:%M')
-        J4_dist = (
-            base_J4.groupby(['HORA_SAIDA', 'MOTORISTA', 'BAIRRO'])
-            .size()
-            .reset_index(name='QTD')
-            .sort_values(['HORA_SAIDA', 'MOTORISTA', 'BAIRRO'])
-        )
-    else:
-        J4_dist = pd.DataFrame(columns=['HORA_SAIDA', 'MOTORISTA', 'BAIRRO', 'QTD'])
+    # Distribuição da 1ª e da 4ª janela com horário (um único groupby)
+    dist = (
+        base[base['JANELA'].isin(['J1', 'J4'])]
+        .groupby(['JANELA', 'MINUTO', 'MOTORISTA', 'BAIRRO'], observed=True)
+        .size()
+        .reset_index(name='QTD')
+    )
+    dist.insert(0, 'HORA_SAIDA', formatar_minutos(dist.pop('MINUTO')))
+    J1_dist = dist[dist['JANELA'] == 'J1'].drop(columns='JANELA')
+    J4_dist = dist[dist['JANELA'] == 'J4'].drop(columns='JANELA')
 
     # Ranking motoristas
-    if 'MOTORISTA' in base.columns and 'BAIRRO' in base.columns:
-        rank = base.groupby(['MOTORISTA', 'BAIRRO']).size().reset_index(name='QTD')
-        rank_tot = rank.groupby('MOTORISTA')['QTD'].sum().reset_index(name='TOTAL_MOTORISTA')
-        rank = rank.merge(rank_tot, on='MOTORISTA')
-        rank = rank.sort_values(
-            ['TOTAL_MOTORISTA', 'QTD', 'MOTORISTA', 'BAIRRO'],
-            ascending=[False, False, True, True]
-        )
-        rank_top20 = rank.head(20)
+    rank = base.groupby(['MOTORISTA', 'BAIRRO'], observed=True).size().reset_index(name='QTD')
+    rank['TOTAL_MOTORISTA'] = rank.groupby('MOTORISTA', observed=True)['QTD'].transform('sum')
+
+    # Top 20 por TOTAL_MOTORISTA e QTD (decrescentes) sem ordenar a tabela
+    # inteira: as linhas já vêm em ordem de MOTORISTA/BAIRRO, então basta
+    # particionar pela chave composta e ordenar (estável) só os candidatos.
+    tot = rank['TOTAL_MOTORISTA'].to_numpy(dtype=np.int64)
+    qtd = rank['QTD'].to_numpy(dtype=np.int64)
+    n_top = min(20, len(rank))
+    if n_top:
+        chave = -(tot * (qtd.max() + 1) + qtd)
+        limite = np.partition(chave, n_top - 1)[n_top - 1]
+        candidatos = np.flatnonzero(chave <= limite)
+        top = candidatos[np.argsort(chave[candidatos], kind='stable')][:n_top]
     else:
-        rank_top20 = pd.DataFrame(columns=['MOTORISTA', 'BAIRRO', 'QTD', 'TOTAL_MOTORISTA'])
+        top = []
+    rank_top20 = rank.iloc[top]
 
     return {
         'data_ref': data_ref.strftime('%d/%m/%Y'),
@@ -199,10 +340,9 @@ def processar_dados_diarios_v2(df, data_referencia):
     """Processa a planilha (df) e retorna os dados do NOVO relatório diário (2 páginas)."""
     data_ref = pd.to_datetime(data_referencia).date()
 
-    if 'DTHRSAIDA' not in df.columns:
-        raise ValueError("A planilha não possui a coluna 'DTHRSAIDA'.")
+    validar_colunas(df, ['DTHRSAIDA'])
 
-    base = df[df['DTHRSAIDA'].dt.date == data_ref].copy()
+    base = df[mascara_dias(df['DTHRSAIDA'], data_ref, data_ref)]
     if base.empty:
         raise ValueError("Não há entregas para a data selecionada.")
 
@@ -210,16 +350,16 @@ def processar_dados_diarios_v2(df, data_referencia):
 
     # Status
     if 'SITUACAO' in base.columns:
-        entregue = (base['SITUACAO'].astype(str).str.contains('Entregue', case=False, na=False)).sum()
-        devolvido = (base['SITUACAO'].astype(str).str.contains('Devolvido', case=False, na=False)).sum()
-        em_entrega = (base['SITUACAO'].astype(str).str.contains('Em Entrega', case=False, na=False)).sum()
+        contagem = np.bincount(classificar_situacao(base['SITUACAO']), minlength=4)
+        entregue = contagem[SIT_ENTREGUE]
+        devolvido = contagem[SIT_DEVOLVIDO]
+        em_entrega = contagem[SIT_EM_ENTREGA]
     else:
         entregue = devolvido = em_entrega = 0
 
     td_pct = round((devolvido / total) * 100, 2) if total else 0.0
 
     # Janelas (J1..J5)
-    base['JANELA'] = base['DTHRSAIDA'].apply(classificar_janela)
     janela_counts = base['JANELA'].value_counts().to_dict()
 
     J1 = int(janela_counts.get('J1', 0))
@@ -230,7 +370,7 @@ def processar_dados_diarios_v2(df, data_referencia):
 
     # Top 10 Motoristas
     if 'MOTORISTA' in base.columns:
-        top_motor = base['MOTORISTA'].value_counts().head(10).reset_index()
+        top_motor = base['MOTORISTA'].value_counts().loc[lambda s: s > 0].head(10).reset_index()
         top_motor.columns = ['Motorista', 'Entregas']
         top_motor['%'] = (top_motor['Entregas'] / total * 100).round(1)
     else:
@@ -238,7 +378,7 @@ def processar_dados_diarios_v2(df, data_referencia):
 
     # Top 10 Bairros
     if 'BAIRRO' in base.columns:
-        top_bairro = base['BAIRRO'].value_counts().head(10).reset_index()
+        top_bairro = base['BAIRRO'].value_counts().loc[lambda s: s > 0].head(10).reset_index()
         top_bairro.columns = ['Bairro', 'Entregas']
         top_bairro['%'] = (top_bairro['Entregas'] / total * 100).round(1)
     else:
@@ -287,6 +427,42 @@ def processar_dados_diarios_v2(df, data_referencia):
 # -------------------------------------------------------------------
 # Processamento de PERÍODO (com sessões 4,5,6)
 # -------------------------------------------------------------------
+# Tipo de veículo por código TPRODADO (a posição no array é o código)
+VEICULO_NAO_MAPEADO = 'Outro / Não mapeado'
+TIPOS_VEICULO = np.array([
+    "00 - Munk",
+    VEICULO_NAO_MAPEADO,
+    "02 - Toco (Caçamba 5m³)",
+    VEICULO_NAO_MAPEADO,
+    VEICULO_NAO_MAPEADO,
+    "05 - Utilitário (HR)",
+    "06 - Caçamba 3m³",
+    "07 - VUC (Carroceria 6m)",
+], dtype=object)
+
+
+def contar_entregas_devolucoes(base, chave, contar_dias=False):
+    """
+    Conta ENTREGAS e DEVOLUCOES por `chave` num único groupby().agg sobre os
+    códigos de SITUACAO (coluna SIT) e calcula TOTAL e TD_PCT de cada grupo.
+    Com `contar_dias`, a mesma passada conta também os dias distintos (DIAS_TRAB).
+    """
+    colunas = {
+        'ENTREGAS': (base['SIT'] == SIT_ENTREGUE).astype(np.int64),
+        'DEVOLUCOES': (base['SIT'] == SIT_DEVOLVIDO).astype(np.int64),
+    }
+    agregacoes = {'ENTREGAS': 'sum', 'DEVOLUCOES': 'sum'}
+    if contar_dias:
+        colunas['DIAS_TRAB'] = base['DIA']
+        agregacoes['DIAS_TRAB'] = 'nunique'
+
+    tabela = pd.DataFrame(colunas).groupby(base[chave], observed=True).agg(agregacoes)
+    tabela['TOTAL'] = tabela['ENTREGAS'] + tabela['DEVOLUCOES']
+    tabela = tabela[tabela['TOTAL'] > 0]  # categorias sem movimento no período
+    tabela['TD_PCT'] = (100 * tabela['DEVOLUCOES'] / tabela['TOTAL']).round(2).where(tabela['TOTAL'] > 0, 0.0)
+    return tabela
+
+
 def processar_dados_periodo(df, data_ini, data_fim):
     """
     Processa a planilha para um PERÍODO (data_ini até data_fim, inclusive)
@@ -303,53 +479,56 @@ def processar_dados_periodo(df, data_ini, data_fim):
     di = pd.to_datetime(data_ini).date()
     dfim = pd.to_datetime(data_fim).date()
 
-    if 'DTHRSAIDA' not in df.columns:
-        raise ValueError("A planilha não possui a coluna 'DTHRSAIDA'.")
+    validar_colunas(df, ['DTHRSAIDA', 'SITUACAO', 'MOTORISTA', 'BAIRRO'])
 
-    datas_candidatas = sorted(df['DTHRSAIDA'].dropna().dt.date.unique())
-    datas_periodo = [d for d in datas_candidatas if di <= d <= dfim]
+    # Base do período (uma única varredura da planilha, comparando datetime64)
+    mask = mascara_dias(df['DTHRSAIDA'], di, dfim)
+    base_periodo = selecionar_linhas(df, mask, ['DTHRSAIDA', 'JANELA', 'SITUACAO', 'MOTORISTA', 'BAIRRO', 'TPRODADO'])
+    base_periodo['DIA'] = base_periodo['DTHRSAIDA'].to_numpy(dtype='datetime64[D]')
 
-    if not datas_periodo:
+    if base_periodo.empty:
         raise ValueError("Não há registros no período informado.")
 
-    linhas_dia = []
-    TOTAL = ENTREGUE = DEVOLVIDO = EM_ENTREGA = 0
-    J1 = J2 = J3 = J4 = J5 = 0
-
-    # Consolidação dia a dia reutilizando a lógica do diário
-    for dia in datas_periodo:
-        dados_dia = processar_dados_diarios(df, dia.strftime('%Y-%m-%d'))
-
-        if dados_dia['TOTAL'] == 0:
-            continue
-
-        TOTAL += dados_dia['TOTAL']
-        ENTREGUE += dados_dia['ENTREGUE']
-        DEVOLVIDO += dados_dia['DEVOLVIDO']
-        EM_ENTREGA += dados_dia['EM_ENTREGA']
-
-        J1 += dados_dia['J1']
-        J2 += dados_dia['J2']
-        J3 += dados_dia['J3']
-        J4 += dados_dia['J4']
-        J5 += dados_dia['J5']
-
-        linhas_dia.append({
-            'DATA': dia.strftime('%d/%m/%Y'),
-            'TOTAL': dados_dia['TOTAL'],
-            'J1': dados_dia['J1'],
-            'J2': dados_dia['J2'],
-            'J3': dados_dia['J3'],
-            'J4': dados_dia['J4'],
-            'J5': dados_dia['J5'],
-            'TD_PCT_DIA': dados_dia['TD_PCT']
-        })
-
-    if not linhas_dia:
-        raise ValueError("Não há registros válidos no período (após consolidar por dia).")
-
-    janela_dia = pd.DataFrame(linhas_dia)
-    n_dias = len(janela_dia)
+    # Consolidação dia a dia (mesmos indicadores do diário): cada linha vira um
+    # índice dia × código e um único np.bincount conta a matriz dias × códigos.
+    base_periodo['SIT'] = classificar_situacao(base_periodo['SITUACAO'])
+    janela = base_periodo['JANELA']
+
+    dias, dia_idx = np.unique(base_periodo['DIA'].to_numpy(), return_inverse=True)
+    n_dias = len(dias)
+    n_sit = SIT_OUTRA + 1
+    n_jan = len(JANELAS) + 1  # coluna 0: sem horário (código -1)
+    sit_dia = np.bincount(dia_idx * n_sit + base_periodo['SIT'].to_numpy(),
+                          minlength=n_dias * n_sit).reshape(n_dias, n_sit)
+    jan_dia = np.bincount(dia_idx * n_jan + janela.cat.codes.to_numpy() + 1,
+                          minlength=n_dias * n_jan).reshape(n_dias, n_jan)[:, 1:]
+    total_dia = sit_dia.sum(axis=1)
+
+    ent_dev_dia = sit_dia[:, SIT_ENTREGUE] + sit_dia[:, SIT_DEVOLVIDO]
+    td_pct_dia = np.round(100 * sit_dia[:, SIT_DEVOLVIDO] / np.maximum(ent_dev_dia, 1), 2)
+
+    janela_dia = pd.DataFrame({
+        'DATA': pd.DatetimeIndex(dias).strftime('%d/%m/%Y'),
+        'TOTAL': total_dia,
+        'J1': jan_dia[:, 0],
+        'J2': jan_dia[:, 1],
+        'J3': jan_dia[:, 2],
+        'J4': jan_dia[:, 3],
+        'J5': jan_dia[:, 4],
+        'TD_PCT_DIA': td_pct_dia,
+    })
+
+    totais_sit = sit_dia.sum(axis=0)
+    totais_jan = jan_dia.sum(axis=0)
+    TOTAL = int(total_dia.sum())
+    ENTREGUE = int(totais_sit[SIT_ENTREGUE])
+    DEVOLVIDO = int(totais_sit[SIT_DEVOLVIDO])
+    EM_ENTREGA = int(totais_sit[SIT_EM_ENTREGA])
+    J1 = int(totais_jan[0])
+    J2 = int(totais_jan[1])
+    J3 = int(totais_jan[2])
+    J4 = int(totais_jan[3])
+    J5 = int(totais_jan[4])
 
     TD_PCT = round(100 * DEVOLVIDO / (ENTREGUE + DEVOLVIDO), 2) if (ENTREGUE + DEVOLVIDO) > 0 else 0.0
 
@@ -369,151 +548,47 @@ def processar_dados_periodo(df, data_ini, data_fim):
     J5_PCT_META = round(100 * J5 / META_J5, 1) if META_J5 else 0
     TOTAL_PCT_META = round(100 * TOTAL / META_TOTAL, 1) if META_TOTAL else 0
 
-    # Base do período (para motorista, bairro, veículo)
-    base_periodo = df[df['DTHRSAIDA'].notna() &
-                      (df['DTHRSAIDA'].dt.date.isin(datas_periodo))].copy()
-
-    if 'SITUACAO' not in base_periodo.columns:
-        raise ValueError("A planilha precisa da coluna 'SITUACAO' para os relatórios de período.")
-
     # ------------------------------------------------------------------
     # 4. PRODUTIVIDADE POR MOTORISTA
     # ------------------------------------------------------------------
-    if 'MOTORISTA' not in base_periodo.columns:
-        raise ValueError("A planilha não possui a coluna 'MOTORISTA'.")
-
     base_motoristas = base_periodo[
-        base_periodo['MOTORISTA'].str.contains('MOTORISTA', case=False, na=False)
-    ].copy()
-
-    ent_motor = base_motoristas[
-        base_motoristas['SITUACAO'].str.contains('Entregue', case=False, na=False)
-    ].groupby('MOTORISTA').size().rename('ENTREGAS')
-
-    dev_motor = base_motoristas[
-        base_motoristas['SITUACAO'].str.contains('Devolvido', case=False, na=False)
-    ].groupby('MOTORISTA').size().rename('DEVOLUCOES')
-
-    prod = pd.concat([ent_motor, dev_motor], axis=1).fillna(0)
-    prod['ENTREGAS'] = prod['ENTREGAS'].astype(int)
-    prod['DEVOLUCOES'] = prod['DEVOLUCOES'].astype(int)
-    prod['TOTAL'] = prod['ENTREGAS'] + prod['DEVOLUCOES']
+        base_periodo['MOTORISTA'].str.contains('MOTORISTA', case=False, na=False, regex=False)
+    ]
 
-    prod['TD_PCT'] = prod.apply(
-        lambda r: round(100 * r['DEVOLUCOES'] / r['TOTAL'], 2) if r['TOTAL'] > 0 else 0.0,
-        axis=1
-    )
-
-    dias_trabalhados = base_motoristas.groupby('MOTORISTA')['DTHRSAIDA'] \
-        .apply(lambda s: s.dt.date.nunique()).rename('DIAS_TRAB')
+    prod = contar_entregas_devolucoes(base_motoristas, 'MOTORISTA', contar_dias=True)
 
-    prod = prod.join(dias_trabalhados, how='left').fillna({'DIAS_TRAB': 0})
-    prod['DIAS_TRAB'] = prod['DIAS_TRAB'].astype(int)
-
-    prod['MEDIA_DIA'] = prod.apply(
-        lambda r: round(r['TOTAL'] / r['DIAS_TRAB'], 1) if r['DIAS_TRAB'] > 0 else 0.0,
-        axis=1
-    )
+    prod['MEDIA_DIA'] = (prod['TOTAL'] / prod['DIAS_TRAB']).round(1).where(prod['DIAS_TRAB'] > 0, 0.0)
 
     prod = prod.sort_values('TOTAL', ascending=False)
 
     prod_tabela = prod.reset_index()[['MOTORISTA', 'ENTREGAS', 'DEVOLUCOES', 'TOTAL', 'TD_PCT', 'MEDIA_DIA']]
 
-    total_row_motor = {
-        'MOTORISTA': 'TOTAL GERAL',
-        'ENTREGAS': int(prod_tabela['ENTREGAS'].sum()),
-        'DEVOLUCOES': int(prod_tabela['DEVOLUCOES'].sum()),
-        'TOTAL': int(prod_tabela['TOTAL'].sum()),
-        'TD_PCT': '',
-        'MEDIA_DIA': ''
-    }
-    prod_tabela = pd.concat([prod_tabela, pd.DataFrame([total_row_motor])], ignore_index=True)
-
     # ------------------------------------------------------------------
     # 5. ANÁLISE POR BAIRRO
     # ------------------------------------------------------------------
-    if 'BAIRRO' not in base_periodo.columns:
-        raise ValueError("A planilha não possui a coluna 'BAIRRO'.")
-
-    ent_bairro = base_periodo[
-        base_periodo['SITUACAO'].str.contains('Entregue', case=False, na=False)
-    ].groupby('BAIRRO').size().rename('ENTREGAS')
-
-    dev_bairro = base_periodo[
-        base_periodo['SITUACAO'].str.contains('Devolvido', case=False, na=False)
-    ].groupby('BAIRRO').size().rename('DEVOLUCOES')
-
-    bairro = pd.concat([ent_bairro, dev_bairro], axis=1).fillna(0)
-    bairro['ENTREGAS'] = bairro['ENTREGAS'].astype(int)
-    bairro['DEVOLUCOES'] = bairro['DEVOLUCOES'].astype(int)
-    bairro['TOTAL'] = bairro['ENTREGAS'] + bairro['DEVOLUCOES']
-
-    bairro['TD_PCT'] = bairro.apply(
-        lambda r: round(100 * r['DEVOLUCOES'] / r['TOTAL'], 2) if r['TOTAL'] > 0 else 0.0,
-        axis=1
-    )
+    bairro = contar_entregas_devolucoes(base_periodo, 'BAIRRO')
 
     bairro = bairro.sort_values('TOTAL', ascending=False)
     bairro_tabela = bairro.reset_index()[['BAIRRO', 'ENTREGAS', 'DEVOLUCOES', 'TOTAL', 'TD_PCT']]
 
-    total_row_bairro = {
-        'BAIRRO': 'TOTAL GERAL',
-        'ENTREGAS': int(bairro_tabela['ENTREGAS'].sum()),
-        'DEVOLUCOES': int(bairro_tabela['DEVOLUCOES'].sum()),
-        'TOTAL': int(bairro_tabela['TOTAL'].sum()),
-        'TD_PCT': ''
-    }
-    bairro_tabela = pd.concat([bairro_tabela, pd.DataFrame([total_row_bairro])], ignore_index=True)
-
     # ------------------------------------------------------------------
     # 6. ANÁLISE POR TIPO DE VEÍCULO (TPRODADO)
     # ------------------------------------------------------------------
     if 'TPRODADO' in base_periodo.columns:
-        mapa_veiculo = {
-            2: "02 - Toco (Caçamba 5m³)",
-            5: "05 - Utilitário (HR)",
-            6: "06 - Caçamba 3m³",
-            7: "07 - VUC (Carroceria 6m)",
-            0: "00 - Munk",
-            2.0: "02 - Toco (Caçamba 5m³)",
-            5.0: "05 - Utilitário (HR)",
-            6.0: "06 - Caçamba 3m³",
-            7.0: "07 - VUC (Carroceria 6m)",
-            0.0: "00 - Munk",
-        }
-
-        base_periodo['VEICULO_TIPO'] = base_periodo['TPRODADO'].map(mapa_veiculo)
-        base_periodo['VEICULO_TIPO'] = base_periodo['VEICULO_TIPO'].fillna('Outro / Não mapeado')
-
-        ent_veic = base_periodo[
-            base_periodo['SITUACAO'].str.contains('Entregue', case=False, na=False)
-        ].groupby('VEICULO_TIPO').size().rename('ENTREGAS')
-
-        dev_veic = base_periodo[
-            base_periodo['SITUACAO'].str.contains('Devolvido', case=False, na=False)
-        ].groupby('VEICULO_TIPO').size().rename('DEVOLUCOES')
-
-        veic = pd.concat([ent_veic, dev_veic], axis=1).fillna(0)
-        veic['ENTREGAS'] = veic['ENTREGAS'].astype(int)
-        veic['DEVOLUCOES'] = veic['DEVOLUCOES'].astype(int)
-        veic['TOTAL'] = veic['ENTREGAS'] + veic['DEVOLUCOES']
-
-        veic['TD_PCT'] = veic.apply(
-            lambda r: round(100 * r['DEVOLUCOES'] / r['TOTAL'], 2) if r['TOTAL'] > 0 else 0.0,
-            axis=1
+        # Só códigos inteiros (2 ou 2.0) entram no mapa; 2.5, texto e vazios não
+        valores = pd.to_numeric(base_periodo['TPRODADO'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        mapeado = (valores >= 0) & (valores < len(TIPOS_VEICULO)) & (valores == np.floor(valores))
+        codigos = np.where(mapeado, valores, 0).astype(np.int64)
+        base_periodo['VEICULO_TIPO'] = np.where(
+            mapeado,
+            TIPOS_VEICULO[codigos],
+            VEICULO_NAO_MAPEADO
         )
 
+        veic = contar_entregas_devolucoes(base_periodo, 'VEICULO_TIPO')
+
         veic = veic.sort_values('TOTAL', ascending=False)
         veic_tabela = veic.reset_index()[['VEICULO_TIPO', 'ENTREGAS', 'DEVOLUCOES', 'TOTAL', 'TD_PCT']]
-
-        total_row_veic = {
-            'VEICULO_TIPO': 'TOTAL GERAL',
-            'ENTREGAS': int(veic_tabela['ENTREGAS'].sum()),
-            'DEVOLUCOES': int(veic_tabela['DEVOLUCOES'].sum()),
-            'TOTAL': int(veic_tabela['TOTAL'].sum()),
-            'TD_PCT': ''
-        }
-        veic_tabela = pd.concat([veic_tabela, pd.DataFrame([total_row_veic])], ignore_index=True)
     else:
         veic_tabela = pd.DataFrame(columns=['VEICULO_TIPO', 'ENTREGAS', 'DEVOLUCOES', 'TOTAL', 'TD_PCT'])
 
@@ -551,95 +626,79 @@ def processar_dados_periodo(df, data_ini, data_fim):
 
 
 # -------------------------------------------------------------------
-# Montagem do HTML – RELATÓRIO DIÁRIO
+# Templates HTML dos relatórios (Jinja2, compilados uma vez na carga do módulo)
 # -------------------------------------------------------------------
-def montar_html_relatorio_diario(dados):
-    """Monta o HTML do relatório DIÁRIO."""
-    logo_src = img_to_data_uri("Logo Oliveira Sem Fundo.png")
-    oliver_src = img_to_data_uri("Oliver_RomaneioSF.png")
+JINJA_ENV = Environment(autoescape=True)
 
-    J1_tabela = gerar_html_tabela(
-        dados['J1_dist'],
-        ['Horário Saída', 'Motorista', 'Bairro', 'Qtde']
-    )
-    J4_tabela = gerar_html_tabela(
-        dados['J4_dist'],
-        ['Horário Saída', 'Motorista', 'Bairro', 'Qtde']
-    )
-    rank_tabela = gerar_html_tabela(
-        dados['rank'],
-        ['Motorista', 'Bairro', 'Qtde', 'Total Motorista']
-    )
 
-    html_content = f"""
-<html>
-<head>
-  <meta charset="UTF-8" />
-  <title>Relatório {dados['data_ref']} - Oliveira Materiais de Construção</title>
-  <style>
-    @page {{
+# -------------------------------------------------------------------
+# Estilos (CSS) dos relatórios
+# -------------------------------------------------------------------
+# Folhas de estilo fixas, compartilhadas entre as requisições. Não vão no
+# HTML: são compiladas uma vez por processo (ver folha_estilo) e passadas ao
+# WeasyPrint na renderização. O logo e o mascote entram como imagem de fundo
+# de .logo/.mascote (ver css_imagens_cabecalho), para que cada imagem seja
+# referenciada uma única vez, mesmo com o cabeçalho repetido em várias páginas.
+CSS_RELATORIO = """
+    @page {
         size: A4;
         margin: 20mm;
-    }}
+    }
 
-    body {{
+    body {
         margin: 0 auto;
         padding: 20px;
         font-family: Arial, Helvetica, sans-serif;
         font-size: 11pt;
         line-height: 1.4;
-    }}
+    }
 
-    .header {{
+    .header {
         display: flex;
         justify-content: space-between;
         align-items: center;
         margin-bottom: 15px;
-        padding-bottom: 10px;
+        padding-bottom: 15px;
         border-bottom: 3px solid #008000;
         min-height: 80px;
-    }}
+    }
 
-    .header .logo-container {{
+    .header .logo,
+    .header .mascote {
         flex: 0 0 auto;
-        max-width: 35%;
-    }}
-
-    .header .logo-container img {{
-        max-width: 100%;
-        height: auto;
-        max-height: 55px;
-    }}
+        background-repeat: no-repeat;
+        background-size: contain;
+    }
 
-    .header .mascote-container {{
-        flex: 0 0 auto;
-        max-width: 40%;
-        text-align: right;
-    }}
+    .header .logo {
+        width: 155px;
+        height: 55px;
+        background-position: left center;
+    }
 
-    .header .mascote-container img {{
-        max-width: 100%;
-        height: auto;
-        max-height: 95px;
-    }}
+    .header .mascote {
+        width: 95px;
+        height: 95px;
+        background-position: right center;
+    }
 
-    .title-block {{
+    .title-block {
         text-align: center;
         margin-top: 15px;
         margin-bottom: 20px;
         font-weight: bold;
         font-size: 16pt;
         color: #008000;
-    }}
+    }
 
-    .subtitle {{
+    .subtitle {
         text-align: center;
         font-size: 12pt;
         margin-bottom: 25px;
         color: #333;
-    }}
+    }
 
-    .section-title {{
+    .section-title {
         font-size: 13pt;
         font-weight: bold;
         color: #008000;
@@ -647,16 +706,16 @@ def montar_html_relatorio_diario(dados):
         margin-bottom: 10px;
         border-bottom: 2px solid #008000;
         padding-bottom: 5px;
-    }}
+    }
 
-    .content {{
+    .content {
         margin-top: 10px;
         font-size: 11pt;
         color: #333;
         line-height: 1.6;
-    }}
+    }
 
-    .footer-bar {{
+    .footer-bar {
         position: fixed;
         bottom: 0;
         left: 0;
@@ -669,47 +728,92 @@ def montar_html_relatorio_diario(dados):
         align-items: center;
         justify-content: center;
         font-weight: bold;
-    }}
+    }
 
-    .page-break {{
+    .page-break {
         page-break-after: always;
-    }}
+    }
 
-    table {{
+    table {
         width: 100%;
         border-collapse: collapse;
         margin-top: 10px;
         margin-bottom: 15px;
         font-size: 10pt;
-    }}
+    }
 
-    table th {{
+    table th {
         background-color: #008000;
         color: white;
         padding: 8px;
         text-align: left;
         font-weight: bold;
-    }}
+    }
 
-    table td {{
+    table td {
         padding: 6px;
         border-bottom: 1px solid #ddd;
-    }}
+    }
 
-    table tr:nth-child(even) {{
+    table tr:nth-child(even) {
         background-color: #f9f9f9;
-    }}
-  </style>
+    }
+"""
+
+CSS_RELATORIO_V2 = """
+    @page { size: A4; margin: 18mm; }
+    body { font-family: Arial, Helvetica, sans-serif; font-size: 11pt; color: #111; }
+    .header {
+      display:flex; justify-content:space-between; align-items:center;
+      border-bottom: 3px solid #008000; padding-bottom: 14px; min-height: 80px;
+    }
+    .logo, .mascote { flex: 0 0 auto; background-repeat: no-repeat; background-size: contain; }
+    .logo { width: 155px; height: 55px; background-position: left center; }
+    .mascote { width: 95px; height: 95px; background-position: right center; }
+    .title { text-align:center; font-weight:700; font-size: 16pt; color:#008000; margin: 14px 0 6px; }
+    .subtitle { text-align:center; font-size: 12pt; color:#333; margin-bottom: 14px; }
+    .section-title {
+      font-size: 13pt; font-weight: 700; color:#008000;
+      margin-top: 16px; border-bottom: 2px solid #008000; padding-bottom: 4px;
+    }
+    table { width:100%; border-collapse: collapse; margin-top: 10px; margin-bottom: 14px; font-size: 10pt; }
+    th { background:#008000; color:#fff; padding: 8px; text-align:left; }
+    td { padding: 6px; border-bottom: 1px solid #ddd; }
+    tr:nth-child(even) { background: #f7f7f7; }
+    .kpis { margin-top: 10px; margin-bottom: 14px; }
+    .kpis strong { color: #008000; }
+    .page-break { page-break-after: always; }
+"""
+
+
+def css_imagens_cabecalho():
+    """CSS que aplica o logo e o mascote (URL file://) aos blocos .logo e .mascote."""
+    regras = []
+    for classe, uri in (('logo', LOGO_URI), ('mascote', MASCOTE_URI)):
+        if uri:
+            regras.append(f"    .header .{classe} {{ background-image: url('{uri}'); }}")
+    return "\n".join(regras)
+
+
+# -------------------------------------------------------------------
+# Montagem do HTML – RELATÓRIO DIÁRIO
+# -------------------------------------------------------------------
+TEMPLATE_RELATORIO_DIARIO = JINJA_ENV.from_string("""
+<html>
+<head>
+  <meta charset="UTF-8" />
+  <title>Relatório {{ dados['data_ref'] }} - Oliveira Materiais de Construção</title>
 </head>
 <body>
   <!-- Página 1 -->
   <div class="header">
-    <div class="logo-container">
-      <img src="{logo_src}" alt="Logo Oliveira" />
-    </div>
-    <div class="mascote-container">
-      <img src="{oliver_src}" alt="Mascote Romaneio" />
-    </div>
+    <div class="logo"></div>
+    <div class="mascote"></div>
+  </div>
+
+  <!-- Rodapé fixo: o WeasyPrint o repete em todas as páginas -->
+  <div class="footer-bar">
+    Oliveira Materiais de Construção - Logística 2025
   </div>
 
   <div class="title-block">
@@ -717,19 +821,19 @@ def montar_html_relatorio_diario(dados):
   </div>
 
   <div class="subtitle">
-    Data de referência: {dados['data_ref']} – Logística 2025
+    Data de referência: {{ dados['data_ref'] }} – Logística 2025
   </div>
 
   <div class="section-title">1. RESUMO EXECUTIVO</div>
   <div class="content">
-    <p><strong>Total de entregas do dia:</strong> {dados['TOTAL']}</p>
-    <p><strong>Entregue:</strong> {dados['ENTREGUE']} &nbsp;|&nbsp;
-       <strong>Devolvido:</strong> {dados['DEVOLVIDO']} &nbsp;|&nbsp;
-       <strong>Em Entrega:</strong> {dados['EM_ENTREGA']}</p>
-    <p><strong>TD% do dia:</strong> {dados['TD_PCT']}%</p>
+    <p><strong>Total de entregas do dia:</strong> {{ dados['TOTAL'] }}</p>
+    <p><strong>Entregue:</strong> {{ dados['ENTREGUE'] }} &nbsp;|&nbsp;
+       <strong>Devolvido:</strong> {{ dados['DEVOLVIDO'] }} &nbsp;|&nbsp;
+       <strong>Em Entrega:</strong> {{ dados['EM_ENTREGA'] }}</p>
+    <p><strong>TD% do dia:</strong> {{ dados['TD_PCT'] }}%</p>
     <p>
-      O volume total {'superou' if dados['TOTAL'] >= 100 else 'ficou abaixo da'} meta de 100 entregas,
-      atingindo {dados['TOTAL_PCT']}% da capacidade planejada.
+      O volume total {{ 'superou' if dados['TOTAL'] >= 100 else 'ficou abaixo da' }} meta de 100 entregas,
+      atingindo {{ dados['TOTAL_PCT'] }}% da capacidade planejada.
     </p>
   </div>
 
@@ -748,348 +852,208 @@ def montar_html_relatorio_diario(dados):
         <tr>
           <td>1ª (saídas antes de 09:00)</td>
           <td>30</td>
-          <td>{dados['J1']}</td>
-          <td>{dados['J1_PCT']}%</td>
+          <td>{{ dados['J1'] }}</td>
+          <td>{{ dados['J1_PCT'] }}%</td>
         </tr>
         <tr>
           <td>2ª (09:00–10:30)</td>
           <td>20</td>
-          <td>{dados['J2']}</td>
-          <td>{dados['J2_PCT']}%</td>
+          <td>{{ dados['J2'] }}</td>
+          <td>{{ dados['J2_PCT'] }}%</td>
         </tr>
         <tr>
           <td>3ª (10:30–12:00)</td>
           <td>10</td>
-          <td>{dados['J3']}</td>
-          <td>{dados['J3_PCT']}%</td>
+          <td>{{ dados['J3'] }}</td>
+          <td>{{ dados['J3_PCT'] }}%</td>
         </tr>
         <tr>
           <td>4ª (12:00–14:30)</td>
           <td>30</td>
-          <td>{dados['J4']}</td>
-          <td>{dados['J4_PCT']}%</td>
+          <td>{{ dados['J4'] }}</td>
+          <td>{{ dados['J4_PCT'] }}%</td>
         </tr>
         <tr>
           <td>5ª (≥ 14:30)</td>
           <td>10</td>
-          <td>{dados['J5']}</td>
-          <td>{dados['J5_PCT']}%</td>
+          <td>{{ dados['J5'] }}</td>
+          <td>{{ dados['J5_PCT'] }}%</td>
         </tr>
         <tr style="font-weight: bold; background-color: #e8f5e9;">
           <td>TOTAL</td>
           <td>100</td>
-          <td>{dados['TOTAL']}</td>
-          <td>{dados['TOTAL_PCT']}%</td>
+          <td>{{ dados['TOTAL'] }}</td>
+          <td>{{ dados['TOTAL_PCT'] }}%</td>
         </tr>
       </tbody>
     </table>
   </div>
 
-  <div class="footer-bar">
-    Oliveira Materiais de Construção - Logística 2025
-  </div>
-
   <div class="page-break"></div>
 
   <!-- Página 2 - 1ª Janela -->
   <div class="header">
-    <div class="logo-container">
-      <img src="{logo_src}" alt="Logo Oliveira" />
-    </div>
-    <div class="mascote-container">
-      <img src="{oliver_src}" alt="Mascote Romaneio" />
-    </div>
+    <div class="logo"></div>
+    <div class="mascote"></div>
   </div>
 
   <div class="section-title">3. DISTRIBUIÇÃO OPERACIONAL – 1ª JANELA (saídas até 09:00)</div>
   <div class="content">
-    <p><strong>Entregas na 1ª janela:</strong> {dados['J1']} &nbsp;|&nbsp; <strong>Meta:</strong> 30 &nbsp;|&nbsp;
-       <strong>Gap vs meta:</strong> {'+' if dados['GAP_J1'] < 0 else ''}{-dados['GAP_J1']} notas.</p>
+    <p><strong>Entregas na 1ª janela:</strong> {{ dados['J1'] }} &nbsp;|&nbsp; <strong>Meta:</strong> 30 &nbsp;|&nbsp;
+       <strong>Gap vs meta:</strong> {{ '+' if dados['GAP_J1'] < 0 else '' }}{{ -dados['GAP_J1'] }} notas.</p>
     <p>Tabela detalhada por horário de saída, motorista e bairro:</p>
-    {J1_tabela}
-  </div>
-
-  <div class="footer-bar">
-    Oliveira Materiais de Construção - Logística 2025
+    {{ J1_tabela }}
   </div>
 
   <div class="page-break"></div>
 
   <!-- Página 3 - 4ª Janela + Ranking -->
   <div class="header">
-    <div class="logo-container">
-      <img src="{logo_src}" alt="Logo Oliveira" />
-    </div>
-    <div class="mascote-container">
-      <img src="{oliver_src}" alt="Mascote Romaneio" />
-    </div>
+    <div class="logo"></div>
+    <div class="mascote"></div>
   </div>
 
   <div class="section-title">4. DISTRIBUIÇÃO OPERACIONAL – 4ª JANELA (12:00–14:30)</div>
   <div class="content">
-    <p><strong>Entregas na 4ª janela:</strong> {dados['J4']} &nbsp;|&nbsp; <strong>Meta:</strong> 30 &nbsp;|&nbsp;
-       <strong>Gap vs meta:</strong> {'+' if dados['GAP_J4'] < 0 else ''}{-dados['GAP_J4']} notas.</p>
+    <p><strong>Entregas na 4ª janela:</strong> {{ dados['J4'] }} &nbsp;|&nbsp; <strong>Meta:</strong> 30 &nbsp;|&nbsp;
+       <strong>Gap vs meta:</strong> {{ '+' if dados['GAP_J4'] < 0 else '' }}{{ -dados['GAP_J4'] }} notas.</p>
     <p>Tabela detalhada por horário de saída, motorista e bairro:</p>
-    {J4_tabela}
+    {{ J4_tabela }}
   </div>
 
   <div class="section-title">5. RANKING DE MOTORISTAS COM BAIRROS – TOP 20</div>
   <div class="content">
     <p>Ordenado pelo <strong>total de entregas do motorista</strong>, mantendo os bairros do mesmo motorista em sequência.</p>
-    {rank_tabela}
-  </div>
-
-  <div class="footer-bar">
-    Oliveira Materiais de Construção - Logística 2025
+    {{ rank_tabela }}
   </div>
 
 </body>
 </html>
-"""
-    return html_content
-
+""")
 
-# -------------------------------------------------------------------
-# Montagem do HTML – RELATÓRIO DE PERÍODO
-# -------------------------------------------------------------------
 
-def montar_html_relatorio_diario_v2(dados):
-    """Monta o HTML do NOVO relatório diário (2 páginas) para PDF."""
-    logo_src = img_to_data_uri("Logo Oliveira Sem Fundo.png")
-    oliver_src = img_to_data_uri("Oliver_RomaneioSF.png")
+def montar_html_relatorio_diario(dados):
+    """Monta o HTML do relatório DIÁRIO."""
+    J1_tabela = gerar_html_tabela(
+        dados['J1_dist'],
+        ['Horário Saída', 'Motorista', 'Bairro', 'Qtde']
+    )
+    J4_tabela = gerar_html_tabela(
+        dados['J4_dist'],
+        ['Horário Saída', 'Motorista', 'Bairro', 'Qtde']
+    )
+    rank_tabela = gerar_html_tabela(
+        dados['rank'],
+        ['Motorista', 'Bairro', 'Qtde', 'Total Motorista']
+    )
 
-    def pct(x):
-        return round((x / dados['TOTAL']) * 100, 1) if dados['TOTAL'] else 0.0
+    return TEMPLATE_RELATORIO_DIARIO.render(
+        dados=dados,
+        J1_tabela=Markup(J1_tabela),
+        J4_tabela=Markup(J4_tabela),
+        rank_tabela=Markup(rank_tabela),
+    )
 
-    tabela_janelas = f"""
-    <table>
-      <thead><tr><th>Janela</th><th>Entregas</th><th>%</th></tr></thead>
-      <tbody>
-        <tr><td>1ª Janela</td><td>{dados['J1']}</td><td>{pct(dados['J1'])}%</td></tr>
-        <tr><td>2ª Janela</td><td>{dados['J2']}</td><td>{pct(dados['J2'])}%</td></tr>
-        <tr><td>3ª Janela</td><td>{dados['J3']}</td><td>{pct(dados['J3'])}%</td></tr>
-        <tr><td>4ª Janela</td><td>{dados['J4']}</td><td>{pct(dados['J4'])}%</td></tr>
-        <tr><td>5ª Janela</td><td>{dados['J5']}</td><td>{pct(dados['J5'])}%</td></tr>
-      </tbody>
-    </table>
-    """
 
-    veic_tbl = gerar_html_tabela(dados['VEIC'], ['Tipo de Veículo', 'Entregas', '%'])
-    exp_tbl  = gerar_html_tabela(dados['EXP'],  ['Expedição', 'Entregas', '%'])
-    mot_tbl  = gerar_html_tabela(dados['TOP_MOTOR'], ['Motorista', 'Entregas', '%'])
-    bai_tbl  = gerar_html_tabela(dados['TOP_BAIRRO'], ['Bairro', 'Entregas', '%'])
+# -------------------------------------------------------------------
+# Montagem do HTML – RELATÓRIO DE PERÍODO
+# -------------------------------------------------------------------
 
-    html = f"""
+TEMPLATE_RELATORIO_DIARIO_V2 = JINJA_ENV.from_string("""
 <!doctype html>
 <html lang="pt-BR">
 <head>
   <meta charset="utf-8">
-  <style>
-    @page {{ size: A4; margin: 18mm; }}
-    body {{ font-family: Arial, Helvetica, sans-serif; font-size: 11pt; color: #111; }}
-    .header {{
-      display:flex; justify-content:space-between; align-items:center;
-      border-bottom: 3px solid #008000; padding-bottom: 10px; min-height: 80px;
-    }}
-    .logo-container img {{ max-height: 55px; }}
-    .mascote-container img {{ max-height: 95px; }}
-    .title {{ text-align:center; font-weight:700; font-size: 16pt; color:#008000; margin: 14px 0 6px; }}
-    .subtitle {{ text-align:center; font-size: 12pt; color:#333; margin-bottom: 14px; }}
-    .section-title {{
-      font-size: 13pt; font-weight: 700; color:#008000;
-      margin-top: 16px; border-bottom: 2px solid #008000; padding-bottom: 4px;
-    }}
-    table {{ width:100%; border-collapse: collapse; margin-top: 10px; margin-bottom: 14px; font-size: 10pt; }}
-    th {{ background:#008000; color:#fff; padding: 8px; text-align:left; }}
-    td {{ padding: 6px; border-bottom: 1px solid #ddd; }}
-    tr:nth-child(even) {{ background: #f7f7f7; }}
-    .kpis {{ margin-top: 10px; margin-bottom: 14px; }}
-    .kpis strong {{ color: #008000; }}
-    .page-break {{ page-break-after: always; }}
-  </style>
 </head>
 <body>
 
   <!-- PÁGINA 1 -->
   <div class="header">
-    <div class="logo-container">{f'<img src="{logo_src}">' if logo_src else ''}</div>
-    <div class="mascote-container">{f'<img src="{oliver_src}">' if oliver_src else ''}</div>
+    <div class="logo"></div>
+    <div class="mascote"></div>
   </div>
 
   <div class="title">RELATÓRIO DIÁRIO DE ENTREGAS</div>
-  <div class="subtitle">Data de referência: {dados['data_ref']}</div>
+  <div class="subtitle">Data de referência: {{ dados['data_ref'] }}</div>
 
   <div class="section-title">1. RESUMO EXECUTIVO</div>
   <div class="kpis">
     <p>
-      <strong>Total:</strong> {dados['TOTAL']} &nbsp;|&nbsp;
-      <strong>Entregue:</strong> {dados['ENTREGUE']} &nbsp;|&nbsp;
-      <strong>Devolvido:</strong> {dados['DEVOLVIDO']} &nbsp;|&nbsp;
-      <strong>Em Entrega:</strong> {dados['EM_ENTREGA']} &nbsp;|&nbsp;
-      <strong>TD%:</strong> {dados['TD_PCT']}%
+      <strong>Total:</strong> {{ dados['TOTAL'] }} &nbsp;|&nbsp;
+      <strong>Entregue:</strong> {{ dados['ENTREGUE'] }} &nbsp;|&nbsp;
+      <strong>Devolvido:</strong> {{ dados['DEVOLVIDO'] }} &nbsp;|&nbsp;
+      <strong>Em Entrega:</strong> {{ dados['EM_ENTREGA'] }} &nbsp;|&nbsp;
+      <strong>TD%:</strong> {{ dados['TD_PCT'] }}%
     </p>
   </div>
 
   <div class="section-title">2. DISTRIBUIÇÃO POR JANELA</div>
-  {tabela_janelas}
+  <table>
+    <thead><tr><th>Janela</th><th>Entregas</th><th>%</th></tr></thead>
+    <tbody>
+      <tr><td>1ª Janela</td><td>{{ dados['J1'] }}</td><td>{{ pct(dados['J1']) }}%</td></tr>
+      <tr><td>2ª Janela</td><td>{{ dados['J2'] }}</td><td>{{ pct(dados['J2']) }}%</td></tr>
+      <tr><td>3ª Janela</td><td>{{ dados['J3'] }}</td><td>{{ pct(dados['J3']) }}%</td></tr>
+      <tr><td>4ª Janela</td><td>{{ dados['J4'] }}</td><td>{{ pct(dados['J4']) }}%</td></tr>
+      <tr><td>5ª Janela</td><td>{{ dados['J5'] }}</td><td>{{ pct(dados['J5']) }}%</td></tr>
+    </tbody>
+  </table>
 
   <div class="section-title">3. ANÁLISE POR TIPO DE VEÍCULO (TPRODADO)</div>
-  {veic_tbl}
+  {{ veic_tbl }}
 
   <div class="section-title">4. ANÁLISE POR EXPEDIÇÃO (ESTABEX)</div>
-  {exp_tbl}
+  {{ exp_tbl }}
 
   <div class="page-break"></div>
 
   <!-- PÁGINA 2 -->
   <div class="header">
-    <div class="logo-container">{f'<img src="{logo_src}">' if logo_src else ''}</div>
-    <div class="mascote-container">{f'<img src="{oliver_src}">' if oliver_src else ''}</div>
+    <div class="logo"></div>
+    <div class="mascote"></div>
   </div>
 
   <div class="title">DESEMPENHO POR MOTORISTA – TOP 10</div>
-  {mot_tbl}
+  {{ mot_tbl }}
 
   <div class="title" style="margin-top:8px;">DISTRIBUIÇÃO GEOGRÁFICA – TOP 10</div>
-  {bai_tbl}
+  {{ bai_tbl }}
 
 </body>
 </html>
-"""
-    return html
-
+""")
 
-def montar_html_relatorio_periodo(dados):
-    """Monta o HTML do relatório de acompanhamento de PERÍODO."""
 
-    logo_src = img_to_data_uri("Logo Oliveira Sem Fundo.png")
-    oliver_src = img_to_data_uri("Oliver_RomaneioSF.png")
+def montar_html_relatorio_diario_v2(dados):
+    """Monta o HTML do NOVO relatório diário (2 páginas) para PDF."""
+    def pct(x):
+        return round((x / dados['TOTAL']) * 100, 1) if dados['TOTAL'] else 0.0
 
-    tabela_periodo = gerar_html_tabela(
-        dados['JANELAS_DIA'],
-        ['Data', 'Total', 'J1', 'J2', 'J3', 'J4', 'J5', 'TD% Dia']
-    )
+    veic_tbl = gerar_html_tabela(dados['VEIC'], ['Tipo de Veículo', 'Entregas', '%'])
+    exp_tbl  = gerar_html_tabela(dados['EXP'],  ['Expedição', 'Entregas', '%'])
+    mot_tbl  = gerar_html_tabela(dados['TOP_MOTOR'], ['Motorista', 'Entregas', '%'])
+    bai_tbl  = gerar_html_tabela(dados['TOP_BAIRRO'], ['Bairro', 'Entregas', '%'])
 
-    tabela_prod = gerar_html_tabela(
-        dados['PROD_MOTORISTA'],
-        ['Motorista', 'Entregas', 'Devoluções', 'Total', 'TD%', 'Média/Dia']
+    return TEMPLATE_RELATORIO_DIARIO_V2.render(
+        dados=dados,
+        pct=pct,
+        veic_tbl=Markup(veic_tbl),
+        exp_tbl=Markup(exp_tbl),
+        mot_tbl=Markup(mot_tbl),
+        bai_tbl=Markup(bai_tbl),
     )
 
-    tabela_bairro = gerar_html_tabela(
-        dados['BAIRRO_ANALISE'],
-        ['Bairro', 'Entregas', 'Devoluções', 'Total', 'TD%']
-    )
 
-    tabela_veic = gerar_html_tabela(
-        dados['VEICULO_ANALISE'],
-        ['Tipo de Veículo', 'Entregas', 'Devoluções', 'Total', 'TD%']
-    )
-
-    html_content = f"""
+TEMPLATE_RELATORIO_PERIODO = JINJA_ENV.from_string("""
 <html>
 <head>
   <meta charset="UTF-8" />
   <title>Relatório de Período - Oliveira Materiais de Construção</title>
-  <style>
-    @page {{
-        size: A4;
-        margin: 20mm;
-    }}
-    body {{
-        margin: 0 auto;
-        padding: 20px;
-        font-family: Arial, Helvetica, sans-serif;
-        font-size: 11pt;
-        line-height: 1.4;
-    }}
-    .header {{
-        display: flex;
-        justify-content: space-between;
-        align-items: center;
-        margin-bottom: 15px;
-        padding-bottom: 10px;
-        border-bottom: 3px solid #008000;
-        min-height: 80px;
-    }}
-    .header .logo-container {{
-        flex: 0 0 auto;
-        max-width: 35%;
-    }}
-    .header .logo-container img {{
-        max-width: 100%;
-        height: auto;
-        max-height: 55px;
-    }}
-    .header .mascote-container {{
-        flex: 0 0 auto;
-        max-width: 40%;
-        text-align: right;
-    }}
-    .header .mascote-container img {{
-        max-width: 100%;
-        height: auto;
-        max-height: 95px;
-    }}
-    .title-block {{
-        text-align: center;
-        margin-top: 15px;
-        margin-bottom: 20px;
-        font-weight: bold;
-        font-size: 16pt;
-        color: #008000;
-    }}
-    .subtitle {{
-        text-align: center;
-        font-size: 12pt;
-        margin-bottom: 25px;
-        color: #333;
-    }}
-    .section-title {{
-        font-size: 13pt;
-        font-weight: bold;
-        color: #008000;
-        margin-top: 20px;
-        margin-bottom: 10px;
-        border-bottom: 2px solid #008000;
-        padding-bottom: 5px;
-    }}
-    .content {{
-        margin-top: 10px;
-        font-size: 11pt;
-        color: #333;
-        line-height: 1.6;
-    }}
-    table {{
-        width: 100%;
-        border-collapse: collapse;
-        margin-top: 10px;
-        margin-bottom: 15px;
-        font-size: 10pt;
-    }}
-    table th {{
-        background-color: #008000;
-        color: white;
-        padding: 8px;
-        text-align: left;
-        font-weight: bold;
-    }}
-    table td {{
-        padding: 6px;
-        border-bottom: 1px solid #ddd;
-    }}
-    table tr:nth-child(even) {{
-        background-color: #f9f9f9;
-    }}
-  </style>
 </head>
 <body>
   <div class="header">
-    <div class="logo-container">
-      <img src="{logo_src}" alt="Logo Oliveira" />
-    </div>
-    <div class="mascote-container">
-      <img src="{oliver_src}" alt="Mascote Romaneio" />
-    </div>
+    <div class="logo"></div>
+    <div class="mascote"></div>
   </div>
 
   <div class="title-block">
@@ -1097,16 +1061,16 @@ def montar_html_relatorio_periodo(dados):
   </div>
 
   <div class="subtitle">
-    Período: {dados['data_ini']} a {dados['data_fim']} – {dados['N_DIAS']} dia(s) com movimento
+    Período: {{ dados['data_ini'] }} a {{ dados['data_fim'] }} – {{ dados['N_DIAS'] }} dia(s) com movimento
   </div>
 
   <div class="section-title">1. RESUMO EXECUTIVO DO PERÍODO</div>
   <div class="content">
-    <p><strong>Total de entregas no período:</strong> {dados['TOTAL']}</p>
-    <p><strong>Entregue:</strong> {dados['ENTREGUE']} &nbsp;|&nbsp;
-       <strong>Devolvido:</strong> {dados['DEVOLVIDO']} &nbsp;|&nbsp;
-       <strong>Em Entrega:</strong> {dados['EM_ENTREGA']}</p>
-    <p><strong>TD% médio do período:</strong> {dados['TD_PCT']}%</p>
+    <p><strong>Total de entregas no período:</strong> {{ dados['TOTAL'] }}</p>
+    <p><strong>Entregue:</strong> {{ dados['ENTREGUE'] }} &nbsp;|&nbsp;
+       <strong>Devolvido:</strong> {{ dados['DEVOLVIDO'] }} &nbsp;|&nbsp;
+       <strong>Em Entrega:</strong> {{ dados['EM_ENTREGA'] }}</p>
+    <p><strong>TD% médio do período:</strong> {{ dados['TD_PCT'] }}%</p>
   </div>
 
   <div class="section-title">2. JANELAS – META x REAL NO PERÍODO</div>
@@ -1123,39 +1087,39 @@ def montar_html_relatorio_periodo(dados):
       <tbody>
         <tr>
           <td>1ª (saídas antes de 09:00)</td>
-          <td>{dados['META_J1']}</td>
-          <td>{dados['J1']}</td>
-          <td>{dados['J1_PCT_META']}%</td>
+          <td>{{ dados['META_J1'] }}</td>
+          <td>{{ dados['J1'] }}</td>
+          <td>{{ dados['J1_PCT_META'] }}%</td>
         </tr>
         <tr>
           <td>2ª (09:00–10:30)</td>
-          <td>{dados['META_J2']}</td>
-          <td>{dados['J2']}</td>
-          <td>{dados['J2_PCT_META']}%</td>
+          <td>{{ dados['META_J2'] }}</td>
+          <td>{{ dados['J2'] }}</td>
+          <td>{{ dados['J2_PCT_META'] }}%</td>
         </tr>
         <tr>
           <td>3ª (10:30–12:00)</td>
-          <td>{dados['META_J3']}</td>
-          <td>{dados['J3']}</td>
-          <td>{dados['J3_PCT_META']}%</td>
+          <td>{{ dados['META_J3'] }}</td>
+          <td>{{ dados['J3'] }}</td>
+          <td>{{ dados['J3_PCT_META'] }}%</td>
         </tr>
         <tr>
           <td>4ª (12:00–14:30)</td>
-          <td>{dados['META_J4']}</td>
-          <td>{dados['J4']}</td>
-          <td>{dados['J4_PCT_META']}%</td>
+          <td>{{ dados['META_J4'] }}</td>
+          <td>{{ dados['J4'] }}</td>
+          <td>{{ dados['J4_PCT_META'] }}%</td>
         </tr>
         <tr>
           <td>5ª (≥ 14:30)</td>
-          <td>{dados['META_J5']}</td>
-          <td>{dados['J5']}</td>
-          <td>{dados['J5_PCT_META']}%</td>
+          <td>{{ dados['META_J5'] }}</td>
+          <td>{{ dados['J5'] }}</td>
+          <td>{{ dados['J5_PCT_META'] }}%</td>
         </tr>
         <tr style="font-weight: bold; background-color: #e8f5e9;">
           <td>TOTAL</td>
-          <td>{dados['META_TOTAL']}</td>
-          <td>{dados['TOTAL']}</td>
-          <td>{dados['TOTAL_PCT_META']}%</td>
+          <td>{{ dados['META_TOTAL'] }}</td>
+          <td>{{ dados['TOTAL'] }}</td>
+          <td>{{ dados['TOTAL_PCT_META'] }}%</td>
         </tr>
       </tbody>
     </table>
@@ -1164,31 +1128,187 @@ def montar_html_relatorio_periodo(dados):
   <div class="section-title">3. DISTRIBUIÇÃO POR DIA E JANELA</div>
   <div class="content">
     <p>Tabela com entregas por dia, total e por janela (incluindo TD% diário):</p>
-    {tabela_periodo}
+    {{ tabela_periodo }}
   </div>
 
   <div class="section-title">4. PRODUTIVIDADE POR MOTORISTA (PERÍODO)</div>
   <div class="content">
     <p>Tabela consolidada de entregas e devoluções por motorista no período.</p>
-    {tabela_prod}
+    {{ tabela_prod }}
   </div>
 
   <div class="section-title">5. ANÁLISE POR BAIRRO (PERÍODO)</div>
   <div class="content">
     <p>Distribuição de entregas e devoluções por bairro no período.</p>
-    {tabela_bairro}
+    {{ tabela_bairro }}
   </div>
 
   <div class="section-title">6. ANÁLISE POR TIPO DE VEÍCULO (PERÍODO)</div>
   <div class="content">
     <p>Distribuição de entregas e devoluções por tipo de veículo no período.</p>
-    {tabela_veic}
+    {{ tabela_veic }}
   </div>
 
 </body>
 </html>
-"""
-    return html_content
+""")
+
+
+def montar_html_relatorio_periodo(dados):
+    """Monta o HTML do relatório de acompanhamento de PERÍODO."""
+
+    def total_geral(tabela, vazias):
+        somas = [int(tabela[col].sum()) for col in ('ENTREGAS', 'DEVOLUCOES', 'TOTAL')]
+        return ['TOTAL GERAL'] + somas + [''] * vazias
+
+    tabela_periodo = gerar_html_tabela(
+        dados['JANELAS_DIA'],
+        ['Data', 'Total', 'J1', 'J2', 'J3', 'J4', 'J5', 'TD% Dia']
+    )
+
+    tabela_prod = gerar_html_tabela(
+        dados['PROD_MOTORISTA'],
+        ['Motorista', 'Entregas', 'Devoluções', 'Total', 'TD%', 'Média/Dia'],
+        totais=total_geral(dados['PROD_MOTORISTA'], 2)
+    )
+
+    tabela_bairro = gerar_html_tabela(
+        dados['BAIRRO_ANALISE'],
+        ['Bairro', 'Entregas', 'Devoluções', 'Total', 'TD%'],
+        totais=total_geral(dados['BAIRRO_ANALISE'], 1)
+    )
+
+    tabela_veic = gerar_html_tabela(
+        dados['VEICULO_ANALISE'],
+        ['Tipo de Veículo', 'Entregas', 'Devoluções', 'Total', 'TD%'],
+        totais=total_geral(dados['VEICULO_ANALISE'], 1)
+    )
+
+    return TEMPLATE_RELATORIO_PERIODO.render(
+        dados=dados,
+        tabela_periodo=Markup(tabela_periodo),
+        tabela_prod=Markup(tabela_prod),
+        tabela_bairro=Markup(tabela_bairro),
+        tabela_veic=Markup(tabela_veic),
+    )
+
+
+# -------------------------------------------------------------------
+# Geração do relatório (pool de processos)
+# -------------------------------------------------------------------
+# Leitura da planilha, processamento com pandas e renderização do WeasyPrint
+# são CPU-bound e demorados; rodam inteiros em processos separados para não
+# prender a thread da requisição (nem disputar o GIL). A fila é limitada:
+# acima de PDF_MAX_PENDENTES relatórios simultâneos a rota responde 503.
+#
+# Por padrão usa os núcleos liberados para este processo (a afinidade respeita
+# o cpuset do contêiner; os.cpu_count() conta os do host), no máximo 4: cada
+# worker carrega pandas, WeasyPrint e a planilha inteira na memória.
+if hasattr(os, "sched_getaffinity"):
+    CPUS_DISPONIVEIS = len(os.sched_getaffinity(0))
+else:
+    CPUS_DISPONIVEIS = os.cpu_count() or 1
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", min(CPUS_DISPONIVEIS, 4)))
+PDF_MAX_PENDENTES = int(os.environ.get("PDF_MAX_PENDENTES", 2 * PDF_WORKERS))
+
+# Os workers são criados sob demanda a partir das threads das requisições;
+# fork com outras threads vivas pode travar o processo filho, então o pool
+# usa forkserver (ou spawn, onde não houver) em vez do fork padrão. Cada
+# worker importa este módulo: por isso o pool só é criado na primeira
+# requisição (ver obter_executor_pdf), e nunca dentro de um worker.
+CONTEXTO_PDF = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+EXECUTOR_PDF = None
+TRAVA_EXECUTOR = threading.Lock()
+VAGAS_PDF = threading.BoundedSemaphore(PDF_MAX_PENDENTES)
+
+# Configuração de fontes e cache de imagens já decodificadas (logo e mascote),
+# reaproveitados por todas as renderizações do processo
+FONT_CONFIG = FontConfiguration()
+CACHE_IMAGENS = {}
+
+
+def obter_executor_pdf():
+    """Devolve o pool de processos dos relatórios, criando-o na primeira chamada."""
+    global EXECUTOR_PDF
+    with TRAVA_EXECUTOR:
+        if EXECUTOR_PDF is None:
+            EXECUTOR_PDF = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=CONTEXTO_PDF)
+        return EXECUTOR_PDF
+
+
+def executar_no_pool(funcao, *args):
+    """
+    Executa funcao(*args) num processo do pool e espera o resultado. Se um
+    worker morrer no meio (falta de memória, falha nativa do WeasyPrint) o pool
+    fica inutilizável: ele é descartado, a próxima chamada cria outro e esta falha.
+    """
+    global EXECUTOR_PDF
+    executor = obter_executor_pdf()
+    try:
+        return executor.submit(funcao, *args).result()
+    except BrokenProcessPool:
+        with TRAVA_EXECUTOR:
+            if EXECUTOR_PDF is executor:
+                EXECUTOR_PDF = None
+        executor.shutdown(wait=False)
+        raise RuntimeError(
+            "O processo que gerava o relatório foi encerrado inesperadamente "
+            "(relatório grande demais?). Tente novamente."
+        ) from None
+
+
+ESTILOS_RELATORIO = {
+    'relatorio': CSS_RELATORIO,
+    'v2': CSS_RELATORIO_V2,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def folha_estilo(nome):
+    """Compila (uma vez por processo) a folha de estilo do relatório com as imagens do cabeçalho."""
+    return CSS(string=ESTILOS_RELATORIO[nome] + "\n" + css_imagens_cabecalho(), font_config=FONT_CONFIG)
+
+
+def renderizar_pdf(html, estilo):
+    """
+    Renderiza o HTML do relatório com a folha de estilo indicada direto num
+    arquivo temporário e devolve o caminho do PDF (quem chama remove o arquivo).
+    """
+    destino = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+    try:
+        with destino:
+            HTML(string=html).write_pdf(
+                destino,
+                stylesheets=[folha_estilo(estilo)],
+                font_config=FONT_CONFIG,
+                cache=CACHE_IMAGENS,
+            )
+    except Exception:
+        os.remove(destino.name)
+        raise
+    return destino.name
+
+
+def gerar_relatorio_pdf(conteudo_planilha, tipo, *datas):
+    """
+    Executa o pipeline completo de um relatório (leitura do Excel, processamento,
+    HTML e PDF) e devolve o caminho do PDF gerado. Roda num processo do pool.
+    """
+    df = carregar_planilha(conteudo_planilha)
+
+    if tipo == "diario":
+        html = montar_html_relatorio_diario(processar_dados_diarios(df, *datas))
+        estilo = 'relatorio'
+    elif tipo == "novo":
+        html = montar_html_relatorio_diario_v2(processar_dados_diarios_v2(df, *datas))
+        estilo = 'v2'
+    else:
+        html = montar_html_relatorio_periodo(processar_dados_periodo(df, *datas))
+        estilo = 'relatorio'
+
+    return renderizar_pdf(html, estilo)
 
 
 # -------------------------------------------------------------------
@@ -1351,10 +1471,6 @@ def gerar():
         if file.filename == "":
             return render_template_string(INDEX_HTML, error="Selecione um arquivo Excel válido.")
 
-        # Lê o Excel em memória
-        df = pd.read_excel(file)
-        df = preparar_dataframe(df)
-
         tipo = request.form.get("tipo_relatorio", "diario")
 
         if tipo in ("diario", "novo"):
@@ -1362,34 +1478,45 @@ def gerar():
             if not data_ref:
                 return render_template_string(INDEX_HTML, error="Informe a data de referência para o relatório diário.")
 
+            datas = (data_ref,)
             if tipo == "diario":
-                dados = processar_dados_diarios(df, data_ref)
-                html = montar_html_relatorio_diario(dados)
                 nome_pdf = f"relatorio_diario_{data_ref}.pdf"
             else:
-                dados = processar_dados_diarios_v2(df, data_ref)
-                html = montar_html_relatorio_diario_v2(dados)
                 nome_pdf = f"relatorio_diario_v2_{data_ref}.pdf"
         else:
             data_ini = request.form.get("data_ini")
             data_fim = request.form.get("data_fim")
             if not data_ini or not data_fim:
                 return render_template_string(INDEX_HTML, error="Informe data inicial e final para o relatório de período.")
-            dados = processar_dados_periodo(df, data_ini, data_fim)
-            html = montar_html_relatorio_periodo(dados)
+            datas = (data_ini, data_fim)
             nome_pdf = f"relatorio_periodo_{data_ini}_a_{data_fim}.pdf"
 
-        # Gera PDF em memória
-        pdf_io = io.BytesIO()
-        HTML(string=html).write_pdf(pdf_io)
-        pdf_io.seek(0)
-
-        return send_file(
-            pdf_io,
+        # Lê o Excel em memória e gera o relatório no pool de processos (fila limitada)
+        conteudo_planilha = file.read()
+        if not VAGAS_PDF.acquire(blocking=False):
+            return render_template_string(
+                INDEX_HTML,
+                error="Servidor ocupado gerando outros relatórios. Tente novamente em instantes."
+            ), 503
+        try:
+            caminho_pdf = executar_no_pool(gerar_relatorio_pdf, conteudo_planilha, tipo, *datas)
+        finally:
+            VAGAS_PDF.release()
+
+        # Abre o PDF gerado pelo worker e já remove o nome do disco: o conteúdo
+        # continua acessível pelo arquivo aberto, enviado em blocos na resposta.
+        arquivo_pdf = open(caminho_pdf, "rb")
+        os.remove(caminho_pdf)
+
+        resposta = send_file(
+            arquivo_pdf,
             mimetype="application/pdf",
             as_attachment=True,
             download_name=nome_pdf
         )
+        # Com um arquivo aberto (e não um caminho) o Werkzeug não sabe o tamanho
+        resposta.content_length = os.fstat(arquivo_pdf.fileno()).st_size
+        return resposta
 
     except Exception as e:
         return render_template_string(INDEX_HTML, error=f"Erro ao gerar relatório: {e}")
@@ -1398,6 +1525,11 @@ def gerar():
 # -------------------------------------------------------------------
 # Execução
 # -------------------------------------------------------------------
+# app.run é o servidor de desenvolvimento. Em produção, usar o gunicorn com
+# um processo e várias threads: o trabalho pesado já roda no EXECUTOR_PDF, e
+# cada worker do gunicorn criaria o seu próprio pool de PDF_WORKERS processos.
+#
+#   gunicorn -w 1 --threads 8 -t 120 -b 0.0.0.0:$PORT app:app
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)